@@ -1,19 +1,40 @@
+import asyncio
 import datetime
+import gzip
 import logging.config
 from environs import Env
 from seller import download_stock
 
+import httpx
+import orjson
 import requests
 
-from seller import divide, price_conversion
+from seller import (
+    RequestLimiter,
+    create_client,
+    create_session,
+    divide,
+    gather_or_cancel,
+    prices_conversion,
+    request_with_retry,
+    stocks_conversion,
+)
 
 logger = logging.getLogger(__file__)
 
+# Размеры запросов к API Yandex Market:
+# PUT campaigns/{id}/offers/stocks — до 2000 товаров (максимум по документации),
+# POST campaigns/{id}/offer-prices/updates — 500 товаров.
+YM_STOCKS_BATCH = 2000
+YM_PRICES_BATCH = 500
+# Одновременно в API Yandex Market уходит не больше стольких запросов
+YM_CONCURRENCY = 10
 
-def get_product_list(page, campaign_id, access_token):
+def get_product_list(session, page, campaign_id, access_token):
     """Получить список товаров в магазине Yandex Market.
 
     Args:
+        session (requests.Session): Сессия для запросов.
         page (str): Последний просмотренный товар.
         campaign_id (str): Идентификатор компании на Yandex Market.
         access_token (str): Ключ API Yandex Market.
@@ -22,30 +43,53 @@ def get_product_list(page, campaign_id, access_token):
         list: Список товаров из магазина Yandex Market в формате json.
 
     Example:
-        >>> get_product_list(page, campaign_id, access_token)
+        >>> get_product_list(session, page, campaign_id, access_token)
     """
     endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = {"Authorization": f"Bearer {access_token}"}
     payload = {
         "page_token": page,
         "limit": 200,
     }
     url = endpoint_url + f"campaigns/{campaign_id}/offer-mapping-entries"
-    response = requests.get(url, headers=headers, params=payload)
+    response = session.get(url, headers=headers, params=payload)
     response.raise_for_status()
-    response_object = response.json()
+    response_object = orjson.loads(response.content)
     return response_object.get("result")
 
 
-def update_stocks(stocks, campaign_id, access_token):
+async def _send_json(client, method, url, payload, headers):
+    """Отправить json-запрос к API Yandex Market.
+
+    Args:
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
+        method (str): HTTP-метод запроса.
+        url (str): Адрес запроса.
+        payload (dict): Тело запроса.
+        headers (dict): Заголовки авторизации.
+
+    Returns:
+        dict: Ответ API Yandex Market в формате JSON.
+    """
+    # Тело запроса сжимаем gzip, ответ httpx распаковывает сам
+    body = gzip.compress(orjson.dumps(payload))
+    headers = {
+        **headers,
+        "Content-Type": "application/json",
+        "Content-Encoding": "gzip",
+        "Accept": "application/json",
+    }
+    response = await request_with_retry(
+        client, method, url, content=body, headers=headers
+    )
+    return orjson.loads(response.content)
+
+
+async def update_stocks(client, stocks, campaign_id, access_token):
     """Обновить остатки в базе Yandex Market.
 
     Args:
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
         stocks (list): Список остатков.
         campaign_id (str): Идентификатор компании на Yandex Market.
         access_token (str): Ключ API Yandex Market.
@@ -54,27 +98,20 @@ def update_stocks(stocks, campaign_id, access_token):
         list: Возвращает ответ API Yandex Market в формате JSON.
 
     Example:
-        >>> update_stocks(stocks, campaign_id, access_token)
+        >>> await update_stocks(client, stocks, campaign_id, access_token)
     """
     endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = {"Authorization": f"Bearer {access_token}"}
     payload = {"skus": stocks}
     url = endpoint_url + f"campaigns/{campaign_id}/offers/stocks"
-    response = requests.put(url, headers=headers, json=payload)
-    response.raise_for_status()
-    response_object = response.json()
-    return response_object
+    return await _send_json(client, "PUT", url, payload, headers)
 
 
-def update_price(prices, campaign_id, access_token):
+async def update_price(client, prices, campaign_id, access_token):
     """Обновить цены товаров в базе Yandex Market.
 
     Args:
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
         prices (list): Список цен.
         campaign_id (str): Идентификатор компании на Yandex Market.
         access_token (str): Ключ API Yandex Market.
@@ -83,21 +120,13 @@ def update_price(prices, campaign_id, access_token):
         list: Возвращает ответ API Yandex Market в формате JSON.
 
     Example:
-        >>> update_price([12000, 13000, 24000], campaign_id, access_token)
+        >>> await update_price(client, [12000, 13000, 24000], campaign_id, access_token)
     """
     endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = {"Authorization": f"Bearer {access_token}"}
     payload = {"offers": prices}
     url = endpoint_url + f"campaigns/{campaign_id}/offer-prices/updates"
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    response_object = response.json()
-    return response_object
+    return await _send_json(client, "POST", url, payload, headers)
 
 
 def get_offer_ids(campaign_id, market_token):
@@ -115,113 +144,107 @@ def get_offer_ids(campaign_id, market_token):
     """
     page = ""
     product_list = []
-    while True:
-        some_prod = get_product_list(page, campaign_id, market_token)
-        product_list.extend(some_prod.get("offerMappingEntries"))
-        page = some_prod.get("paging").get("nextPageToken")
-        if not page:
-            break
+    # Своя сессия на каждый обход: обходы FBS и DBS идут в разных потоках,
+    # а requests.Session не потокобезопасна.
+    with create_session() as session:
+        session.headers["Accept"] = "application/json"
+        while True:
+            some_prod = get_product_list(session, page, campaign_id, market_token)
+            product_list.extend(some_prod.get("offerMappingEntries"))
+            page = some_prod.get("paging").get("nextPageToken")
+            if not page:
+                break
     offer_ids = []
     for product in product_list:
         offer_ids.append(product.get("offer").get("shopSku"))
     return offer_ids
 
 
-def create_stocks(watch_remnants, offer_ids, warehouse_id):
+def create_stocks(watch_remnants, offer_set, warehouse_id):
     """Создать список остатков по файлу ostatki.xls и данным с Yandex Market.
 
     Args:
-        watch_remnants (dict): Cписок данных из файла ostatki.xls.
-        offer_ids (list): Список артикулов.
+        watch_remnants (pandas.DataFrame): Данные из файла ostatki.xls.
+        offer_set (frozenset): Множество артикулов.
         warehouse_id (str): Идентификатор склада.
 
     Returns:
         stocks (list): Список остатков по файлу ostatki.xls и данным с Yandex Market.
 
     Example:
-        >>> create_stocks(watch_remnants, offer_ids, warehouse_id)
+        >>> create_stocks(watch_remnants, offer_set, warehouse_id)
     """
     # Уберем то, что не загружено в market
-    stocks = list()
+    remaining = set(offer_set)
     date = str(datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z")
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append(
-                {
-                    "sku": str(watch.get("Код")),
-                    "warehouseId": warehouse_id,
-                    "items": [
-                        {
-                            "count": stock,
-                            "type": "FIT",
-                            "updatedAt": date,
-                        }
-                    ],
-                }
-            )
-            offer_ids.remove(str(watch.get("Код")))
-    # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append(
-            {
-                "sku": offer_id,
-                "warehouseId": warehouse_id,
-                "items": [
-                    {
-                        "count": 0,
-                        "type": "FIT",
-                        "updatedAt": date,
-                    }
-                ],
-            }
-        )
+    codes = watch_remnants["Код"].astype(str)
+    selected = codes.isin(remaining) & ~codes.duplicated()
+    codes = codes[selected].tolist()
+    stock_counts = stocks_conversion(watch_remnants.loc[selected, "Количество"])
+    base_item = {"type": "FIT", "updatedAt": date}
+    stocks = [
+        {
+            "sku": offer_id,
+            "warehouseId": warehouse_id,
+            "items": [{"count": stock, **base_item}],
+        }
+        for offer_id, stock in zip(codes, stock_counts)
+    ]
+    remaining.difference_update(codes)
+    # Добавим недостающее из загруженного.
+    # Список items общий: остатки только сериализуются в JSON и не меняются.
+    empty_items = [{"count": 0, **base_item}]
+    stocks.extend(
+        {"sku": offer_id, "warehouseId": warehouse_id, "items": empty_items}
+        for offer_id in remaining
+    )
     return stocks
 
 
-def create_prices(watch_remnants, offer_ids):
+def create_prices(watch_remnants, offer_set):
     """Создать список сконвертированных из файла цен.
 
     Args:
-        watch_remnants (dict): Cписок данных из файла ostatki.xls.
-        offer_ids (list): Список артикулов.
+        watch_remnants (pandas.DataFrame): Данные из файла ostatki.xls.
+        offer_set (frozenset): Множество артикулов.
 
     Returns:
         prices (list): Список цен.
 
     Example:
-        >>> create_prices(watch_remnants, offer_ids)
+        >>> create_prices(watch_remnants, offer_set)
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "id": str(watch.get("Код")),
-                # "feed": {"id": 0},
-                "price": {
-                    "value": int(price_conversion(watch.get("Цена"))),
-                    # "discountBase": 0,
-                    "currencyId": "RUR",
-                    # "vat": 0,
-                },
-                # "marketSku": 0,
-                # "shopSku": "string",
-            }
-            prices.append(price)
+    codes = watch_remnants["Код"].astype(str)
+    selected = codes.isin(offer_set)
+    values = prices_conversion(watch_remnants.loc[selected, "Цена"]).astype(int)
+    prices = [
+        {
+            "id": offer_id,
+            # "feed": {"id": 0},
+            "price": {
+                "value": value,
+                # "discountBase": 0,
+                "currencyId": "RUR",
+                # "vat": 0,
+            },
+            # "marketSku": 0,
+            # "shopSku": "string",
+        }
+        for offer_id, value in zip(codes[selected], values.tolist())
+    ]
     return prices
 
 
-async def upload_prices(watch_remnants, campaign_id, market_token):
+async def upload_prices(
+    client, limiter, watch_remnants, offer_set, campaign_id, market_token
+):
     """Загрузить цены.
 
     Args:
-        watch_remnants (dict): Cписок данных из файла ostatki.xls.
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
+        limiter (RequestLimiter): Ограничитель числа одновременных запросов.
+        watch_remnants (pandas.DataFrame): Данные из файла ostatki.xls.
+        offer_set (frozenset): Множество артикулов.
         campaign_id (str): Идентификатор компании на Yandex Market.
         market_token (str): Ключ API Yandex Market.
 
@@ -229,20 +252,38 @@ async def upload_prices(watch_remnants, campaign_id, market_token):
         list: Список обновлённых цен.
 
     Correct example:
-        >>> upload_prices(watch_remnants, campaign_id, market_token)
+        >>> await upload_prices(
+        >>>     client, limiter, watch_remnants, offer_set, campaign_id, market_token
+        >>> )
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
-    prices = create_prices(watch_remnants, offer_ids)
-    for some_prices in list(divide(prices, 500)):
-        update_price(some_prices, campaign_id, market_token)
+    prices = create_prices(watch_remnants, offer_set)
+    await gather_or_cancel(
+        *(
+            limiter.run(
+                update_price, client, some_prices, campaign_id, market_token
+            )
+            for some_prices in divide(prices, YM_PRICES_BATCH)
+        )
+    )
     return prices
 
 
-async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id):
+async def upload_stocks(
+    client,
+    limiter,
+    watch_remnants,
+    offer_set,
+    campaign_id,
+    market_token,
+    warehouse_id,
+):
     """Загрузить остатки.
 
     Args:
-        watch_remnants (dict): Cписок данных из файла ostatki.xls.
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
+        limiter (RequestLimiter): Ограничитель числа одновременных запросов.
+        watch_remnants (pandas.DataFrame): Данные из файла ostatki.xls.
+        offer_set (frozenset): Множество артикулов.
         campaign_id (str): Идентификатор компании на Yandex Market.
         market_token (str): Ключ API Yandex Market.
         warehouse_id (str): Идентификатор склада.
@@ -251,19 +292,30 @@ async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id)
         tuple: Список не пустых остатков и список остатков.
 
     Correct example:
-        >>> upload_stocks(watch_remnants,  campaign_id, market_token, warehouse_id)
+        >>> await upload_stocks(
+        >>>     client,
+        >>>     limiter,
+        >>>     watch_remnants,
+        >>>     offer_set,
+        >>>     campaign_id,
+        >>>     market_token,
+        >>>     warehouse_id,
+        >>> )
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
-    stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
-    for some_stock in list(divide(stocks, 2000)):
-        update_stocks(some_stock, campaign_id, market_token)
-    not_empty = list(
-        filter(lambda stock: (stock.get("items")[0].get("count") != 0), stocks)
+    stocks = create_stocks(watch_remnants, offer_set, warehouse_id)
+    await gather_or_cancel(
+        *(
+            limiter.run(
+                update_stocks, client, some_stock, campaign_id, market_token
+            )
+            for some_stock in divide(stocks, YM_STOCKS_BATCH)
+        )
     )
+    not_empty = [stock for stock in stocks if stock["items"][0]["count"]]
     return not_empty, stocks
 
 
-def main():
+async def main():
     """Основная функция, обновляющая остатки и изменяющая цены.
 
     Raises:
@@ -278,7 +330,7 @@ def main():
         (доставкой занимается Yandex, лишь хранение и сборка на владельце).
 
     Correct example:
-        >>> main()
+        >>> asyncio.run(main())
     """
     env = Env()
     market_token = env.str("MARKET_TOKEN")
@@ -287,32 +339,66 @@ def main():
     warehouse_fbs_id = env.str("WAREHOUSE_FBS_ID")
     warehouse_dbs_id = env.str("WAREHOUSE_DBS_ID")
 
-    watch_remnants = download_stock()
     try:
-        # FBS
-        offer_ids = get_offer_ids(campaign_fbs_id, market_token)
-        # Обновить остатки FBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_fbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_fbs_id, market_token)
-        # Поменять цены FBS
-        upload_prices(watch_remnants, campaign_fbs_id, market_token)
-
-        # DBS
-        offer_ids = get_offer_ids(campaign_dbs_id, market_token)
-        # Обновить остатки DBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_dbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_dbs_id, market_token)
-        # Поменять цены DBS
-        upload_prices(watch_remnants, campaign_dbs_id, market_token)
-    except requests.exceptions.ReadTimeout:
+        # Артикулы каждой компании и остатки с сайта загружаем одновременно
+        watch_remnants, fbs_offer_ids, dbs_offer_ids = await asyncio.gather(
+            asyncio.to_thread(download_stock),
+            asyncio.to_thread(get_offer_ids, campaign_fbs_id, market_token),
+            asyncio.to_thread(get_offer_ids, campaign_dbs_id, market_token),
+        )
+        fbs_offer_set = frozenset(fbs_offer_ids)
+        dbs_offer_set = frozenset(dbs_offer_ids)
+        limiter = RequestLimiter(YM_CONCURRENCY)
+        async with create_client() as client:
+            await gather_or_cancel(
+                # Обновить остатки и поменять цены FBS
+                upload_stocks(
+                    client,
+                    limiter,
+                    watch_remnants,
+                    fbs_offer_set,
+                    campaign_fbs_id,
+                    market_token,
+                    warehouse_fbs_id,
+                ),
+                upload_prices(
+                    client,
+                    limiter,
+                    watch_remnants,
+                    fbs_offer_set,
+                    campaign_fbs_id,
+                    market_token,
+                ),
+                # Обновить остатки и поменять цены DBS
+                upload_stocks(
+                    client,
+                    limiter,
+                    watch_remnants,
+                    dbs_offer_set,
+                    campaign_dbs_id,
+                    market_token,
+                    warehouse_dbs_id,
+                ),
+                upload_prices(
+                    client,
+                    limiter,
+                    watch_remnants,
+                    dbs_offer_set,
+                    campaign_dbs_id,
+                    market_token,
+                ),
+            )
+    except (requests.exceptions.ReadTimeout, httpx.TimeoutException):
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
+    except (
+        requests.exceptions.ConnectionError,
+        httpx.NetworkError,
+        httpx.RemoteProtocolError,
+    ) as error:
         print(error, "Ошибка соединения")
     except Exception as error:
         print(error, "ERROR_2")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,20 +1,68 @@
+import asyncio
+import gzip
 import io
 import logging.config
-import os
+import random
 import re
 import zipfile
 from environs import Env
 
+import httpx
+import numpy as np
+import orjson
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__file__)
 
+_PRICE_RE = re.compile(r"[^0-9]")
 
-def get_product_list(last_id, client_id, seller_token):
+# Максимальные размеры запросов из документации Ozon Seller API:
+# /v1/product/import/stocks — до 100 товаров,
+# /v1/product/import/prices — до 1000 товаров.
+OZON_STOCKS_BATCH = 100
+OZON_PRICES_BATCH = 1000
+# Одновременно в API Ozon уходит не больше стольких запросов
+OZON_CONCURRENCY = 10
+
+# Повторы запросов при сбоях: 5 попыток с экспоненциальной задержкой
+RETRY_TOTAL = 5
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def create_session():
+    """Создать сессию requests с пулом соединений и повтором запросов.
+
+    Returns:
+        requests.Session: Сессия с HTTPAdapter для https.
+
+    Example:
+        >>> session = create_session()
+    """
+    retry = Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        backoff_jitter=0.25,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "POST", "PUT"]),
+        respect_retry_after_header=True,
+    )
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry),
+    )
+    return session
+
+
+def get_product_list(session, last_id, client_id, seller_token):
     """Получить список товаров в магазине Ozon.
 
     Args:
+        session (requests.Session): Сессия для запросов.
         last_id (str): Последний просмотренный товар.
         client_id (str): Идентификатор клиента Ozon.
         seller_token (str): Ключ API Ozon.
@@ -23,12 +71,13 @@ def get_product_list(last_id, client_id, seller_token):
         list: Список товаров из магазина Ozon в формате json.
 
     Example:
-        >>> get_product_list(last_id, client_id, seller_token)
+        >>> get_product_list(session, last_id, client_id, seller_token)
     """
     url = "https://api-seller.ozon.ru/v2/product/list"
     headers = {
         "Client-Id": client_id,
         "Api-Key": seller_token,
+        "Content-Type": "application/json",
     }
     payload = {
         "filter": {
@@ -37,9 +86,9 @@ def get_product_list(last_id, client_id, seller_token):
         "last_id": last_id,
         "limit": 1000,
     }
-    response = requests.post(url, json=payload, headers=headers)
+    response = session.post(url, data=orjson.dumps(payload), headers=headers)
     response.raise_for_status()
-    response_object = response.json()
+    response_object = orjson.loads(response.content)
     return response_object.get("result")
 
 
@@ -58,23 +107,177 @@ def get_offer_ids(client_id, seller_token):
     """
     last_id = ""
     product_list = []
-    while True:
-        some_prod = get_product_list(last_id, client_id, seller_token)
-        product_list.extend(some_prod.get("items"))
-        total = some_prod.get("total")
-        last_id = some_prod.get("last_id")
-        if total == len(product_list):
-            break
+    # Своя сессия на каждый обход: get_offer_ids и download_stock работают
+    # в разных потоках, а requests.Session не потокобезопасна.
+    with create_session() as session:
+        while True:
+            some_prod = get_product_list(session, last_id, client_id, seller_token)
+            product_list.extend(some_prod.get("items"))
+            total = some_prod.get("total")
+            last_id = some_prod.get("last_id")
+            if total == len(product_list):
+                break
     offer_ids = []
     for product in product_list:
         offer_ids.append(product.get("offer_id"))
     return offer_ids
 
 
-def update_price(prices: list, client_id, seller_token):
+def create_client():
+    """Создать HTTP/2-клиент httpx для загрузки остатков и цен.
+
+    Транспорт сам повторяет запрос при ошибке установки соединения.
+
+    Returns:
+        httpx.AsyncClient: Клиент с пулом соединений и таймаутом 30 секунд.
+
+    Example:
+        >>> async with create_client() as client:
+        >>>     await update_stocks(client, stocks, client_id, seller_token)
+    """
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_connections=50),
+    )
+    return httpx.AsyncClient(transport=transport, timeout=30.0)
+
+
+class RequestLimiter:
+    """Ограничитель числа одновременных запросов к API.
+
+    После первой ошибки новые запросы не начинаются: ожидающие вызовы
+    отменяются, как только доходит их очередь.
+
+    Args:
+        limit (int): Наибольшее число одновременных запросов.
+
+    Example:
+        >>> limiter = RequestLimiter(10)
+        >>> await limiter.run(update_stocks, client, stocks, client_id, seller_token)
+    """
+
+    def __init__(self, limit):
+        self._semaphore = asyncio.Semaphore(limit)
+        self.failed = False
+
+    async def run(self, function, *args):
+        """Вызвать корутинную функцию, заняв место в ограничителе.
+
+        Корутина создаётся только после того, как место получено, поэтому
+        при отмене ожидающих вызовов не остаётся незапущенных корутин.
+
+        Args:
+            function (Callable): Корутинная функция с запросом к API.
+            *args: Аргументы для function.
+
+        Returns:
+            object: Результат function.
+
+        Raises:
+            asyncio.CancelledError: Один из предыдущих запросов завершился ошибкой.
+        """
+        async with self._semaphore:
+            if self.failed:
+                raise asyncio.CancelledError
+            try:
+                return await function(*args)
+            except Exception:
+                self.failed = True
+                raise
+
+
+async def gather_or_cancel(*coroutines):
+    """Выполнить корутины одновременно, при первой ошибке отменив остальные.
+
+    Args:
+        *coroutines (Coroutine): Корутины для выполнения.
+
+    Returns:
+        list: Результаты корутин в порядке передачи.
+
+    Raises:
+        Exception: Первая ошибка среди корутин; остальные к этому моменту
+            отменены и завершены.
+
+    Example:
+        >>> await gather_or_cancel(upload_stocks(...), upload_prices(...))
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def request_with_retry(client, method, url, **kwargs):
+    """Выполнить запрос, повторяя его при 429 и ошибках сервера.
+
+    Задержка между попытками растёт экспоненциально, со случайной
+    добавкой; если сервер прислал Retry-After в секундах, ждём столько.
+
+    Args:
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
+        method (str): HTTP-метод запроса.
+        url (str): Адрес запроса.
+        **kwargs: Остальные аргументы httpx.AsyncClient.request.
+
+    Returns:
+        httpx.Response: Успешный ответ сервера.
+
+    Raises:
+        httpx.HTTPStatusError: Ошибка сохранилась после всех попыток.
+
+    Example:
+        >>> await request_with_retry(client, "POST", url, content=body)
+    """
+    for attempt in range(RETRY_TOTAL + 1):
+        response = await client.request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == RETRY_TOTAL:
+            break
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            delay = int(retry_after)
+        else:
+            delay = RETRY_BACKOFF * 2**attempt + random.uniform(0, 0.25)
+        await asyncio.sleep(delay)
+    response.raise_for_status()
+    return response
+
+
+async def _post_json(client, url, payload, headers):
+    """Отправить json-запрос к API Ozon.
+
+    Args:
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
+        url (str): Адрес запроса.
+        payload (dict): Тело запроса.
+        headers (dict): Заголовки запроса.
+
+    Returns:
+        dict: Ответ API Ozon в формате JSON.
+    """
+    # Тело запроса сжимаем gzip, ответ httpx распаковывает сам
+    body = gzip.compress(orjson.dumps(payload))
+    headers = {
+        **headers,
+        "Content-Type": "application/json",
+        "Content-Encoding": "gzip",
+    }
+    response = await request_with_retry(
+        client, "POST", url, content=body, headers=headers
+    )
+    return orjson.loads(response.content)
+
+
+async def update_price(client, prices: list, client_id, seller_token):
     """Обновить цены товаров в базе Ozon.
 
     Args:
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
         prices (list): Список цен.
         client_id (str): Идентификатор клиента Ozon.
         seller_token (str): Ключ API Ozon.
@@ -83,7 +286,7 @@ def update_price(prices: list, client_id, seller_token):
         list: Возвращает ответ API Ozon в формате JSON.
 
     Example:
-        >>> update_price([12000, 13000, 24000], client_id, seller_token)
+        >>> await update_price(client, [12000, 13000, 24000], client_id, seller_token)
     """
     url = "https://api-seller.ozon.ru/v1/product/import/prices"
     headers = {
@@ -91,15 +294,14 @@ def update_price(prices: list, client_id, seller_token):
         "Api-Key": seller_token,
     }
     payload = {"prices": prices}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return await _post_json(client, url, payload, headers)
 
 
-def update_stocks(stocks: list, client_id, seller_token):
+async def update_stocks(client, stocks: list, client_id, seller_token):
     """Обновить остатки в базе Ozon.
 
     Args:
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
         stocks (list): Список остатков.
         client_id (str): Идентификатор клиента Ozon.
         seller_token (str): Ключ API Ozon.
@@ -108,7 +310,7 @@ def update_stocks(stocks: list, client_id, seller_token):
         list: Возвращает ответ API Ozon в формате JSON.
 
     Example:
-        >>> update_stocks(stocks, client_id, seller_token)
+        >>> await update_stocks(client, stocks, client_id, seller_token)
     """
     url = "https://api-seller.ozon.ru/v1/product/import/stocks"
     headers = {
@@ -116,95 +318,96 @@ def update_stocks(stocks: list, client_id, seller_token):
         "Api-Key": seller_token,
     }
     payload = {"stocks": stocks}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return await _post_json(client, url, payload, headers)
 
 
 def download_stock():
     """Скачать и получить данные по остаткам товаров из файла с сайта casio.
 
     Returns:
-        watch_remnants (dict): Возвращает список данных в формате DataFrame.
+        watch_remnants (pandas.DataFrame): Возвращает данные в формате DataFrame.
 
     Example:
         >>> download_stock()
     """
     # Скачать остатки с сайта
     casio_url = "https://timeworld.ru/upload/files/ostatki.zip"
-    session = requests.Session()
-    response = session.get(casio_url)
-    response.raise_for_status()
-    with response, zipfile.ZipFile(io.BytesIO(response.content)) as archive:
-        archive.extractall(".")
-    # Создаем список остатков часов:
-    excel_file = "ostatki.xls"
-    watch_remnants = pd.read_excel(
-        io=excel_file,
-        na_values=None,
-        keep_default_na=False,
-        header=17,
-    ).to_dict(orient="records")
-    os.remove("./ostatki.xls")  # Удалить файл
+    archive_file = io.BytesIO()
+    with create_session() as session:
+        with session.get(casio_url, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                archive_file.write(chunk)
+    archive_file.seek(0)
+    # Создаем список остатков часов, не распаковывая архив на диск:
+    with zipfile.ZipFile(archive_file) as archive:
+        with archive.open("ostatki.xls") as excel_file:
+            watch_remnants = pd.read_excel(
+                io=excel_file,
+                engine="calamine",
+                na_values=None,
+                keep_default_na=False,
+                header=17,
+            )
     return watch_remnants
 
 
-def create_stocks(watch_remnants, offer_ids):
+def create_stocks(watch_remnants, offer_set):
     """Создать список остатков по файлу ostatki.xls и данным с Ozon.
 
     Args:
-        watch_remnants (dict): Cписок данных из файла ostatki.xls.
-        offer_ids (list): Список артикулов.
+        watch_remnants (pandas.DataFrame): Данные из файла ostatki.xls.
+        offer_set (frozenset): Множество артикулов.
 
     Returns:
         stocks (list): Список остатков по файлу ostatki.xls и данным с Ozon.
 
     Example:
-        >>> create_stocks(watch_remnants, offer_ids)
+        >>> create_stocks(watch_remnants, offer_set)
     """
     # Уберем то, что не загружено в seller
-    stocks = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append({"offer_id": str(watch.get("Код")), "stock": stock})
-            offer_ids.remove(str(watch.get("Код")))
+    remaining = set(offer_set)
+    codes = watch_remnants["Код"].astype(str)
+    selected = codes.isin(remaining) & ~codes.duplicated()
+    codes = codes[selected].tolist()
+    stock_counts = stocks_conversion(watch_remnants.loc[selected, "Количество"])
+    stocks = [
+        {"offer_id": offer_id, "stock": stock}
+        for offer_id, stock in zip(codes, stock_counts)
+    ]
+    remaining.difference_update(codes)
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
+    for offer_id in remaining:
         stocks.append({"offer_id": offer_id, "stock": 0})
     return stocks
 
 
-def create_prices(watch_remnants, offer_ids):
+def create_prices(watch_remnants, offer_set):
     """Создать список сконвертированных из файла цен.
 
     Args:
-        watch_remnants (dict): Cписок данных из файла ostatki.xls.
-        offer_ids (list): Список артикулов.
+        watch_remnants (pandas.DataFrame): Данные из файла ostatki.xls.
+        offer_set (frozenset): Множество артикулов.
 
     Returns:
         prices (list): Список цен.
 
     Example:
-        >>> create_prices(watch_remnants, offer_ids)
+        >>> create_prices(watch_remnants, offer_set)
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "auto_action_enabled": "UNKNOWN",
-                "currency_code": "RUB",
-                "offer_id": str(watch.get("Код")),
-                "old_price": "0",
-                "price": price_conversion(watch.get("Цена")),
-            }
-            prices.append(price)
+    codes = watch_remnants["Код"].astype(str)
+    selected = codes.isin(offer_set)
+    values = prices_conversion(watch_remnants.loc[selected, "Цена"])
+    prices = [
+        {
+            "auto_action_enabled": "UNKNOWN",
+            "currency_code": "RUB",
+            "offer_id": offer_id,
+            "old_price": "0",
+            "price": price,
+        }
+        for offer_id, price in zip(codes[selected], values)
+    ]
     return prices
 
 
@@ -226,7 +429,54 @@ def price_conversion(price: str) -> str:
         price_conversion(15)
         ^^^^^^^^^^^^^^^^
     """
-    return re.sub("[^0-9]", "", price.split(".")[0])
+    return _PRICE_RE.sub("", price.split(".", 1)[0])
+
+
+def prices_conversion(prices: pd.Series) -> pd.Series:
+    """Конвертация столбца с ценами в столбец цен без доп. символов.
+
+    Args:
+        prices (pandas.Series): Столбец строк с ценами.
+
+    Returns:
+        pandas.Series: Столбец строк, содержащих лишь цифры.
+
+    Correct example:
+        >>> print(prices_conversion(pd.Series(["5'990.00 руб."])).tolist())
+        ['5990']
+    """
+    return (
+        prices.astype(str)
+        .str.split(".")
+        .str[0]
+        .str.replace(_PRICE_RE, "", regex=True)
+    )
+
+
+def stocks_conversion(counts: pd.Series) -> list:
+    """Конвертация столбца с количеством товара в остатки.
+
+    Args:
+        counts (pandas.Series): Столбец с количеством товара.
+
+    Returns:
+        list: Список остатков: ">10" — 100, "1" — 0, иначе само количество.
+
+    Correct example:
+        >>> print(stocks_conversion(pd.Series([">10", "1", 5])))
+        [100, 0, 5]
+    """
+    counts = counts.astype(str)
+    stocks = np.where(
+        counts == ">10",
+        100,
+        np.where(
+            counts == "1",
+            0,
+            pd.to_numeric(counts, errors="coerce").fillna(0).astype(int),
+        ),
+    )
+    return stocks.tolist()
 
 
 def divide(lst: list, n: int):
@@ -257,11 +507,16 @@ def divide(lst: list, n: int):
         yield lst[i: i + n]
 
 
-async def upload_prices(watch_remnants, client_id, seller_token):
+async def upload_prices(
+    client, limiter, watch_remnants, offer_set, client_id, seller_token
+):
     """Загрузить цены.
 
     Args:
-        watch_remnants (dict): Cписок данных из файла ostatki.xls.
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
+        limiter (RequestLimiter): Ограничитель числа одновременных запросов.
+        watch_remnants (pandas.DataFrame): Данные из файла ostatki.xls.
+        offer_set (frozenset): Множество артикулов.
         client_id (str): Идентификатор клиента Ozon.
         seller_token (str): Ключ API Ozon.
 
@@ -269,20 +524,32 @@ async def upload_prices(watch_remnants, client_id, seller_token):
         list: Список обновлённых цен.
 
     Correct example:
-        >>> upload_prices(watch_remnants, client_id, seller_token)
+        >>> await upload_prices(
+        >>>     client, limiter, watch_remnants, offer_set, client_id, seller_token
+        >>> )
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
-    prices = create_prices(watch_remnants, offer_ids)
-    for some_price in list(divide(prices, 1000)):
-        update_price(some_price, client_id, seller_token)
+    prices = create_prices(watch_remnants, offer_set)
+    await gather_or_cancel(
+        *(
+            limiter.run(
+                update_price, client, some_price, client_id, seller_token
+            )
+            for some_price in divide(prices, OZON_PRICES_BATCH)
+        )
+    )
     return prices
 
 
-async def upload_stocks(watch_remnants, client_id, seller_token):
+async def upload_stocks(
+    client, limiter, watch_remnants, offer_set, client_id, seller_token
+):
     """Загрузить остатки.
 
     Args:
-        watch_remnants (dict): Cписок данных из файла ostatki.xls.
+        client (httpx.AsyncClient): HTTP/2-клиент для запросов.
+        limiter (RequestLimiter): Ограничитель числа одновременных запросов.
+        watch_remnants (pandas.DataFrame): Данные из файла ostatki.xls.
+        offer_set (frozenset): Множество артикулов.
         client_id (str): Идентификатор клиента Ozon.
         seller_token (str): Ключ API Ozon.
 
@@ -290,17 +557,24 @@ async def upload_stocks(watch_remnants, client_id, seller_token):
         tuple: Список не пустых остатков и список остатков.
 
     Correct example:
-        >>> upload_stocks(watch_remnants, client_id, seller_token)
+        >>> await upload_stocks(
+        >>>     client, limiter, watch_remnants, offer_set, client_id, seller_token
+        >>> )
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
-    stocks = create_stocks(watch_remnants, offer_ids)
-    for some_stock in list(divide(stocks, 100)):
-        update_stocks(some_stock, client_id, seller_token)
-    not_empty = list(filter(lambda stock: (stock.get("stock") != 0), stocks))
+    stocks = create_stocks(watch_remnants, offer_set)
+    await gather_or_cancel(
+        *(
+            limiter.run(
+                update_stocks, client, some_stock, client_id, seller_token
+            )
+            for some_stock in divide(stocks, OZON_STOCKS_BATCH)
+        )
+    )
+    not_empty = [stock for stock in stocks if stock["stock"]]
     return not_empty, stocks
 
 
-def main():
+async def main():
     """Основная функция, обновляющая остатки и изменяющая цены.
 
     Raises:
@@ -309,29 +583,51 @@ def main():
         Exception: ERROR_2.
 
     Correct example:
-        >>> main()
+        >>> asyncio.run(main())
     """
     env = Env()
     seller_token = env.str("SELLER_TOKEN")
     client_id = env.str("CLIENT_ID")
     try:
-        offer_ids = get_offer_ids(client_id, seller_token)
-        watch_remnants = download_stock()
-        # Обновить остатки
-        stocks = create_stocks(watch_remnants, offer_ids)
-        for some_stock in list(divide(stocks, 100)):
-            update_stocks(some_stock, client_id, seller_token)
-        # Поменять цены
-        prices = create_prices(watch_remnants, offer_ids)
-        for some_price in list(divide(prices, 900)):
-            update_price(some_price, client_id, seller_token)
-    except requests.exceptions.ReadTimeout:
+        # Артикулы и остатки с сайта загружаем одновременно
+        offer_ids, watch_remnants = await asyncio.gather(
+            asyncio.to_thread(get_offer_ids, client_id, seller_token),
+            asyncio.to_thread(download_stock),
+        )
+        offer_set = frozenset(offer_ids)
+        limiter = RequestLimiter(OZON_CONCURRENCY)
+        async with create_client() as client:
+            await gather_or_cancel(
+                # Обновить остатки
+                upload_stocks(
+                    client,
+                    limiter,
+                    watch_remnants,
+                    offer_set,
+                    client_id,
+                    seller_token,
+                ),
+                # Поменять цены
+                upload_prices(
+                    client,
+                    limiter,
+                    watch_remnants,
+                    offer_set,
+                    client_id,
+                    seller_token,
+                ),
+            )
+    except (requests.exceptions.ReadTimeout, httpx.TimeoutException):
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
+    except (
+        requests.exceptions.ConnectionError,
+        httpx.NetworkError,
+        httpx.RemoteProtocolError,
+    ) as error:
         print(error, "Ошибка соединения")
     except Exception as error:
         print(error, "ERROR_2")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())